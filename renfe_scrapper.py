@@ -4,17 +4,28 @@ Instalar con: pip install playwright && playwright install
 """
 
 from playwright.sync_api import sync_playwright
-import time
 from datetime import datetime
-from difflib import SequenceMatcher
+from pathlib import Path
+from types import MappingProxyType
+import json
+import os
 import re
-import asyncio
 
-class RenfeScraperPlaywright:
-    """Scraper de Renfe con Playwright (versión ordenada, MISMA lógica/flujo).
+try:  # RapidFuzz (C++) si está disponible; si no, difflib puro Python
+    from rapidfuzz import fuzz, process
+except ImportError:  # pragma: no cover
+    fuzz = process = None
+    from difflib import SequenceMatcher
 
-    Nota: Se han reagrupado utilidades, constantes y manejo de selectores
-    para mejorar legibilidad, sin alterar el comportamiento observable.
+_RE_HHMM = re.compile(r"\b(\d{2}:\d{2})\b")
+_LAUNCH_ARGS = ["--lang=es", "--headless=new"]
+
+class RenfeScraperBase:
+    """Parte común de los scrapers síncrono y asíncrono.
+
+    Solo contiene lo que no hace I/O con el navegador: selectores, snippets JS,
+    estado de la instancia, construcción de locators y utilidades puras
+    (parseo, fuzzy, impresión).
     """
 
     # --------------------------- Constantes/Selectores --------------------------- #
@@ -51,6 +62,14 @@ class RenfeScraperPlaywright:
         "input[type='text'][placeholder*='Salida']",
     )
 
+    _SELECTORS_FECHA_IDA = (
+        "button:has-text('FECHA IDA')",
+        "label:has-text('FECHA IDA')",
+        "input[placeholder*='Fecha'][placeholder*='ida']",
+        "input[id*='date'][id*='out']",
+        "input[type='text'][placeholder*='Salida']",
+    )
+
     _SELECTORS_SUGERENCIAS = (
         "[id*='origin'][id*='options'] li",
         "[id*='destination'][id*='options'] li",
@@ -65,7 +84,15 @@ class RenfeScraperPlaywright:
         "button:has-text('BUSCAR')",
     )
 
-    _MESES = {
+    # Recursos que no hacen falta para autocompletar/fecha/búsqueda
+    _RECURSOS_BLOQUEADOS = frozenset({"image", "font", "media"})
+    _HOSTS_BLOQUEADOS = (
+        "google-analytics",
+        "googletagmanager",
+        "doubleclick",
+    )
+
+    _MESES = MappingProxyType({
         "enero": 1,
         "febrero": 2,
         "marzo": 3,
@@ -79,116 +106,447 @@ class RenfeScraperPlaywright:
         "octubre": 10,
         "noviembre": 11,
         "diciembre": 12,
-    }
+    })
+
+    _URL_RENFE = "https://www.renfe.com/es/es"
+    _SEL_FILAS_IDA = "#listaTrenesTBodyIda .row.selectedTren"
+
+    # Calendario Lightpick (solo ida)
+    _SEL_CALENDARIO = ".lightpick"
+    _SEL_DIAS_CALENDARIO = ".lightpick__days"
+    _SEL_VIAJE_SOLO_IDA = "#trip-option label:has-text('Viaje solo ida')"
+    _SEL_MES_VISIBLE = ".lightpick__select-months option[selected], .rf-daterange-picker-alternative__month-label"
+    _SEL_DIAS_DISPONIBLES = ".lightpick__day.is-available:not(.is-previous-month):not(.is-next-month)"
+    _SEL_ACEPTAR_FECHA = "button.lightpick__apply-action-sub"
+
+    # Pares [mes, año] candidatos del calendario, leídos en un único round-trip
+    _JS_LEER_MES_Y_ANYO = """() => {
+        const txt = el => (el.innerText || el.textContent || '');
+        const pares = [];
+        const om = document.querySelector('.lightpick__select-months option[selected]');
+        const oy = document.querySelector('.lightpick__select-years option[selected]');
+        if (om && oy) pares.push([txt(om), txt(oy)]);
+        const alt = document.querySelectorAll('.rf-daterange-picker-alternative__month-label span');
+        if (alt.length >= 2) pares.push([txt(alt[0]), txt(alt[1])]);
+        return pares;
+    }"""
+
+    # Lee todas las filas en un único round-trip al navegador
+    _JS_FILAS_IDA = """els => els.map((r, i) => {
+        const hs = [...r.querySelectorAll('.col-md-8.trenes h5')].map(h => h.innerText);
+        return {
+            horas: hs,
+            has_precio: !!r.querySelector('.precio-final'),
+            has_plaza_h: !!r.querySelector(`.plazas-h, #ahorro_tren_i_${i + 1} .accessiblechair`),
+        };
+    })"""
+
+    # Salta al mes objetivo: API de Lightpick si está expuesta; si no, todos
+    # los clics de siguiente/anterior en el mismo round-trip, sin esperas
+    _JS_NAVEGAR_MES = """({y, m, diff}) => {
+        const picker = window.lightpickInstance;
+        if (picker && typeof picker.gotoDate === 'function') {
+            picker.gotoDate(new Date(y, m - 1, 1));
+            return true;
+        }
+        const sel = diff > 0 ? 'button.lightpick__next-action' : 'button.lightpick__previous-action';
+        for (let i = 0; i < Math.abs(diff); i++) {
+            const btn = document.querySelector(sel);
+            if (!btn) return false;
+            btn.click();
+        }
+        return true;
+    }"""
+
+    # Clic directo en la celda del día por su data-time (medianoche local)
+    _JS_CLICK_DIA = """({y, m, d}) => {
+        const t = new Date(y, m - 1, d).setHours(0, 0, 0, 0);
+        const el = document.querySelector(".lightpick .lightpick__day[data-time='" + t + "']");
+        if (el && !el.classList.contains('is-previous-month') && !el.classList.contains('is-next-month')) {
+            el.click();
+            return true;
+        }
+        return false;
+    }"""
 
     # ------------------------------- Inicialización ------------------------------ #
-    def __init__(self, headless: bool = True):
+    def __init__(
+        self,
+        headless: bool = True,
+        default_timeout_ms: int = 3000,
+        block_assets: bool = True,
+        storage_state_path="renfe_state.json",
+    ):
         self.headless = headless
+        self.default_timeout_ms = default_timeout_ms
+        self.block_assets = block_assets
+        # Cookies/localStorage persistidos entre ejecuciones (None para desactivar)
+        self.storage_state_path = Path(storage_state_path) if storage_state_path else None
+        self._estado_cargado = False
         self.playwright = None
         self.browser = None
+        self.context = None
         self.page = None
+        # (tipo, estación pedida) -> (texto elegido, score) para repetir sin teclear
+        self._station_cache = {}
+        # Última búsqueda completada: evita repetir el scraping para la misma consulta
+        self._last_query = None
+        self._last_viajes = []
+
+    def _visibles(self, selectores):
+        """Un locator 'visible=true' por selector, en el orden (de prioridad) de la tupla.
+
+        Solo construye locators (sin round-trip), así que vale para sync y async.
+        """
+        return [self.page.locator(f"{sel} >> visible=true") for sel in selectores]
+
+    def _union_visibles(self, selectores):
+        """Locator que casa con cualquier elemento visible de los selectores."""
+        cands = self._visibles(selectores)
+        loc = cands[0]
+        for cand in cands[1:]:
+            loc = loc.or_(cand)
+        return loc.first
+
+    def _ruta_estado_tmp(self) -> Path:
+        """Temporal único por proceso/instancia para la escritura atómica del estado."""
+        return self.storage_state_path.with_name(f"{self.storage_state_path.name}.{os.getpid()}-{id(self)}.tmp")
+
+    def _debe_bloquear(self, request) -> bool:
+        return request.resource_type in self._RECURSOS_BLOQUEADOS or any(
+            h in request.url for h in self._HOSTS_BLOQUEADOS
+        )
+
+    # ------------------------------- Utilidades -------------------------------- #
+    def similitud_texto(self, a: str, b: str) -> float:
+        """Calcula la similitud entre dos textos (case-insensitive), en [0, 1]."""
+        if fuzz is not None:
+            return fuzz.ratio(a, b, processor=str.lower) / 100.0
+        return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+
+    def _month_diff(self, src_m: int, src_y: int, dst_m: int, dst_y: int) -> int:
+        return (dst_y - src_y) * 12 + (dst_m - src_m)
+
+    def _hhmm_a_min(self, hhmm: str):
+        """Convierte 'HH:MM' a minutos desde medianoche (None si no es válido)."""
+        try:
+            h, m = map(int, hhmm.split(":"))
+            return h * 60 + m
+        except Exception:
+            return None
+
+    def buscar_estacion_aproximada(self, estacion_deseada, textos):
+        """Encuentra la estación más similar entre los textos de autocompletar.
+
+        Retorna (indice, texto, score); (None, None, 0.0) si ninguna se parece.
+        """
+        # Coincidencia exacta (caso habitual: "Madrid"): no hace falta puntuar
+        objetivo = estacion_deseada.casefold()
+        for i, texto in enumerate(textos):
+            if texto.casefold() == objetivo:
+                return i, texto, 1.0
+
+        if process is not None:
+            best = process.extractOne(estacion_deseada, textos, scorer=fuzz.ratio, processor=str.lower)
+            if best is None or best[1] <= 0:
+                return None, None, 0.0
+            texto, score, idx = best
+            return idx, texto, score / 100.0
+
+        mejor_idx, mejor_score = None, 0.0
+        n = len(estacion_deseada)
+        for i, texto in enumerate(textos):
+            # Cota superior del ratio por longitudes: 2*min/(suma). Si no puede
+            # superar al mejor actual, se evita el cálculo completo.
+            m = len(texto)
+            if m + n == 0 or 2 * min(m, n) / (m + n) <= mejor_score:
+                continue
+            score = self.similitud_texto(estacion_deseada, texto)
+            if score > mejor_score:
+                mejor_score, mejor_idx = score, i
+        if mejor_idx is None:
+            return None, None, 0.0
+        return mejor_idx, textos[mejor_idx], mejor_score
+
+    def _mes_y_anyo_de(self, candidatos):
+        """Primer par [mes, año] válido de los leídos del calendario, o None."""
+        for mes_txt, anyo_txt in candidatos:
+            mes_txt, anyo_txt = mes_txt.strip().lower(), anyo_txt.strip()
+            if mes_txt in self._MESES and anyo_txt.isdigit():
+                return self._MESES[mes_txt], int(anyo_txt)
+        return None
+
+    def _meses_a_navegar(self, visible, fecha: datetime, diff_desde_hoy: int) -> int:
+        """Meses a mover el calendario: desde el mes visible o, si no se lee, desde hoy.
+
+        `diff_desde_hoy` se calcula antes de abrir el calendario.
+        """
+        if not visible:
+            return diff_desde_hoy
+        mes_vis, anyo_vis = visible
+        return max(-60, min(self._month_diff(mes_vis, anyo_vis, fecha.month, fecha.year), 60))
+
+    # --------------------------------- Resultados -------------------------------- #
+    def _resultado_busqueda(self, fecha: str):
+        """Dict de resultado de buscar_billetes antes de empezar."""
+        return {
+            "ok": False,
+            "origen_seleccionado": None,
+            "destino_seleccionado": None,
+            "fecha": fecha,
+            "url": None,
+            "viajes": [],
+        }
+
+    def _resultado_check(self):
+        """Dict de resultado de esta_lleno_en_hora antes de empezar."""
+        return {
+            "ok": False,
+            "estado": "NO_ENCONTRADO",
+            "salida": None,
+            "llegada": None,
+            "url": None,
+        }
+
+    def _completar_check(self, resultado, viajes, hora_objetivo: str, tolerancia_min: int, imprimir: bool) -> bool:
+        """Rellena `resultado` con el trayecto más cercano; False si no hay ninguno."""
+        mejor = self._trayecto_cerca(viajes, hora_objetivo, tolerancia_min)
+        if mejor is None:
+            if imprimir:
+                print(f"⚠ No se encontró tren con salida {hora_objetivo} (±{tolerancia_min} min).")
+            return False
+        resultado.update(
+            {
+                "ok": True,
+                "estado": mejor.get("estado", "DESCONOCIDO"),
+                "salida": mejor.get("salida"),
+                "llegada": mejor.get("llegada"),
+            }
+        )
+        return True
+
+    def _parsear_filas(self, filas):
+        """Convierte las filas crudas de _JS_FILAS_IDA en dicts de trayecto."""
+        viajes = []
+        for fila in filas:
+            horas = fila["horas"]
+            if len(horas) < 2:
+                continue
+            m1 = _RE_HHMM.search(horas[0].strip())
+            m2 = _RE_HHMM.search(horas[-1].strip())
+            if not (m1 and m2):
+                continue
+
+            if fila["has_precio"]:
+                estado = "OK"
+            elif fila["has_plaza_h"]:
+                estado = "LLENO"
+            else:
+                estado = "DESCONOCIDO"
+
+            salida = m1.group(1)
+            viajes.append({
+                "salida": salida,
+                "llegada": m2.group(1),
+                "estado": estado,
+                "salida_min": int(salida[:2]) * 60 + int(salida[3:]),
+            })
+        return viajes
 
+    def _trayecto_cerca(self, viajes, hora_objetivo: str, tolerancia_min: int):
+        """Trayecto con salida más cercana a 'HH:MM' dentro de la tolerancia (o None).
+
+        Corta en cuanto encuentra una coincidencia exacta.
+        """
+        objetivo_min = self._hhmm_a_min(hora_objetivo)
+        if objetivo_min is not None:
+            mejor, mejor_diff = None, 10**9
+            for v in viajes:
+                if "salida_min" not in v:
+                    continue
+                diff = abs(v["salida_min"] - objetivo_min)
+                if diff <= tolerancia_min and diff < mejor_diff:
+                    mejor, mejor_diff = v, diff
+                    if diff == 0:
+                        break
+            if mejor is not None:
+                return mejor
+
+        for v in viajes:
+            if v.get("salida") == hora_objetivo:
+                return v
+        return None
+
+    def imprimir_trayectos(self, origen: str, destino: str, viajes):
+        """Imprime lista numerada de trayectos (IDA)."""
+        if not viajes:
+            print("⚠ No se encontraron trayectos para mostrar.")
+            return
+
+        print("\n🧾 LISTADO DE TRAYECTOS (IDA)")
+        for idx, v in enumerate(viajes, start=1):
+            if v.get("estado") == "OK":
+                estado_str = "TREN OK ✓"
+            elif v.get("estado") == "LLENO":
+                estado_str = "TREN LLENO ✗"
+            else:
+                estado_str = "ESTADO DESCONOCIDO ?"
+            print(f"{idx}. {origen} → {destino} | salida {v['salida']} | llegada {v['llegada']} | {estado_str}")
+
+    def _imprimir_check(self, origen: str, destino: str, fecha: str, resultado) -> None:
+        """Imprime una línea con el estado del tren comprobado."""
+        if resultado["estado"] == "OK":
+            print(
+                f"✓ {origen} → {destino} | {fecha} {resultado['salida']}–{resultado['llegada']} · TREN OK"
+            )
+        elif resultado["estado"] == "LLENO":
+            print(
+                f"✗ {origen} → {destino} | {fecha} {resultado['salida']}–{resultado['llegada']} · TREN LLENO"
+            )
+        else:
+            print(
+                f"? {origen} → {destino} | {fecha} {resultado['salida']}–{resultado['llegada']} · ESTADO DESCONOCIDO"
+            )
+
+
+class RenfeScraperPlaywright(RenfeScraperBase):
+    """Scraper de Renfe con Playwright (versión ordenada, MISMA lógica/flujo).
+
+    Nota: Se han reagrupado utilidades, constantes y manejo de selectores
+    para mejorar legibilidad, sin alterar el comportamiento observable.
+    """
+
+    # ------------------------------- Inicialización ------------------------------ #
     def __enter__(self):
         self.playwright = sync_playwright().start()
-        self.browser = self.playwright.chromium.launch(headless=self.headless, args=["--lang=es", "--headless=new"]) 
-        self.page = self.browser.new_page()
-        self.page.set_viewport_size(self._VIEWPORT)
+        self.browser = self.playwright.chromium.launch(headless=self.headless, args=_LAUNCH_ARGS) 
+        estado = None
+        if self.storage_state_path and self.storage_state_path.exists():
+            estado = str(self.storage_state_path)
+        try:
+            self.context = self.browser.new_context(viewport=self._VIEWPORT, storage_state=estado)
+            self._estado_cargado = estado is not None
+        except Exception:
+            # Estado corrupto o ilegible: contexto limpio
+            self.context = self.browser.new_context(viewport=self._VIEWPORT)
+        self.page = self.context.new_page()
+        # Un único timeout para esperas/acciones; la navegación necesita más margen
+        self.page.set_default_timeout(self.default_timeout_ms)
+        self.page.set_default_navigation_timeout(max(self.default_timeout_ms, 15000))
+        if self.block_assets:
+            self.page.route("**/*", self._filtrar_recursos)
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.context and self.storage_state_path:
+            self._guardar_estado()
         if self.browser:
             self.browser.close()
         if self.playwright:
             self.playwright.stop()
 
-    # ------------------------------- Utilidades -------------------------------- #
-    def similitud_texto(self, a: str, b: str) -> float:
-        """Calcula la similitud entre dos textos (case-insensitive)."""
-        return SequenceMatcher(None, a.lower(), b.lower()).ratio()
+    def _guardar_estado(self):
+        """Guarda cookies/localStorage con escritura atómica (varios scrapers a la vez)."""
+        try:
+            tmp = self._ruta_estado_tmp()
+            tmp.write_text(json.dumps(self.context.storage_state()), encoding="utf-8")
+            os.replace(tmp, self.storage_state_path)
+        except Exception as e:
+            print(f"⚠ No se pudo guardar el estado del navegador: {e}")
 
-    def _month_diff(self, src_m: int, src_y: int, dst_m: int, dst_y: int) -> int:
-        return (dst_y - src_y) * 12 + (dst_m - src_m)
+    def _filtrar_recursos(self, route):
+        """Aborta imágenes/fuentes/media y analítica; deja pasar el resto."""
+        if self._debe_bloquear(route.request):
+            route.abort()
+        else:
+            route.continue_()
 
-    def _min_diff(self, hhmm_a: str, hhmm_b: str) -> int:
-        """Diferencia absoluta en minutos entre 'HH:MM' y 'HH:MM'."""
+    # ------------------------------- Utilidades -------------------------------- #
+    def _primer_visible(self, selectores, timeout=None):
+        """Primer elemento visible de los selectores, en una sola espera.
+
+        Se espera a la unión de todos y después se elige respetando el orden
+        de la tupla (específicos primero), no el orden del DOM. Retorna el
+        locator, o None si ninguno aparece dentro del timeout (el de la
+        página si no se indica).
+        """
+        union = self._union_visibles(selectores)
         try:
-            ha, ma = map(int, hhmm_a.split(":"))
-            hb, mb = map(int, hhmm_b.split(":"))
-            return abs((ha * 60 + ma) - (hb * 60 + mb))
+            union.wait_for(state="visible", timeout=timeout)
         except Exception:
-            return 9999
+            return None
+        for cand in self._visibles(selectores):
+            try:
+                if cand.count() > 0:
+                    return cand.first
+            except Exception:
+                continue
+        return union  # desapareció entre la espera y el conteo: lo que casó en la espera
 
     # ------------------------------ Cookies/Modo ida ----------------------------- #
     def aceptar_cookies(self):
         """Acepta cookies si aparecen (varios selectores tolerantes)."""
         try:
-            for selector in self._SELECTORS_COOKIES:
-                try:
-                    boton = self.page.locator(selector).first
-                    if boton.is_visible(timeout=3000):
-                        boton.click()
-                        print("✓ Cookies aceptadas")
-                        time.sleep(1)
-                        return
-                except Exception:
-                    continue
-            print("⚠ No se encontró banner de cookies")
+            if self._estado_cargado and self.page.locator(", ".join(self._SELECTORS_COOKIES)).count() == 0:
+                print("✓ Cookies ya aceptadas (estado guardado)")
+                return
+            boton = self._primer_visible(self._SELECTORS_COOKIES)
+            if not boton:
+                print("⚠ No se encontró banner de cookies")
+                return
+            boton.click()
+            print("✓ Cookies aceptadas")
+            try:
+                boton.wait_for(state="hidden")
+            except Exception:
+                pass
         except Exception as e:
             print(f"⚠ Error con cookies: {e}")
 
     def seleccionar_solo_ida(self):
         """Selecciona solo ida (si no está ya por defecto)."""
         try:
-            for selector in self._SELECTORS_SOLO_IDA:
-                try:
-                    elemento = self.page.locator(selector).first
-                    if elemento.is_visible(timeout=2000):
-                        elemento.click(force=True)
-                        print("✓ Seleccionado viaje de IDA")
-                        time.sleep(0.5)
-                        return
-                except Exception:
-                    continue
-            print("⚠ No se pudo seleccionar 'Ida' - puede estar por defecto")
+            elemento = self._primer_visible(self._SELECTORS_SOLO_IDA)
+            if not elemento:
+                print("⚠ No se pudo seleccionar 'Ida' - puede estar por defecto")
+                return
+            elemento.click(force=True)
+            print("✓ Seleccionado viaje de IDA")
         except Exception as e:
             print(f"⚠ Error al seleccionar ida: {e}")
 
     # ------------------------------- Autocompletado ------------------------------ #
-    def buscar_estacion_aproximada(self, estacion_deseada, opciones):
-        """Encuentra la estación más similar entre opciones de autocompletar."""
-        mejor_opcion, mejor_score = None, 0.0
-        for opcion in opciones:
-            try:
-                texto = opcion.inner_text().strip()
-            except Exception:
-                continue
-            score = self.similitud_texto(estacion_deseada, texto)
-            if score > mejor_score:
-                mejor_score, mejor_opcion = score, opcion
-        return mejor_opcion, mejor_score
-
     def _resolver_input_y_sugerencias(self, tipo: str, etiqueta: str):
         """Retorna (input_locator, lista_opciones) con selectores tolerantes."""
         input_selectors = self._SELECTORS_INPUT_ORIGEN if tipo == "origin" else self._SELECTORS_INPUT_DESTINO
 
-        input_box = None
-        for sel in input_selectors:
-            try:
-                cand = self.page.locator(sel).first
-                if cand.is_visible(timeout=2000):
-                    input_box = cand
-                    break
-            except Exception:
-                continue
+        input_box = self._primer_visible(input_selectors)
         if not input_box:
             print(f"✗ No se encontró el campo de {etiqueta}")
             return None, []
 
         input_box.click()
         input_box.fill("")
-        time.sleep(0.3)
         return input_box, []
 
+    def _leer_sugerencias(self):
+        """Espera al desplegable y retorna (locator_opciones, textos) o (None, [])."""
+        try:
+            self._union_visibles(self._SELECTORS_SUGERENCIAS).wait_for(state="visible")
+        except Exception:
+            pass  # sin desplegable: el llamador lo trata como "sin sugerencias"
+
+        # Un único round-trip por selector para leer todos los textos
+        for sel in self._SELECTORS_SUGERENCIAS:
+            try:
+                loc = self.page.locator(sel)
+                textos = [t.strip() for t in loc.all_inner_texts()]
+                if textos:
+                    return loc, textos
+            except Exception:
+                continue
+        return None, []
+
     def rellenar_estacion(self, tipo: str, estacion: str):
         """Rellena origen/destino con heurística de autocompletado tolerante."""
         try:
@@ -199,32 +557,34 @@ class RenfeScraperPlaywright:
             if not input_box:
                 return None, 0.0
 
-            input_box.type(estacion, delay=100)
-            time.sleep(0.3)
+            cacheado = self._station_cache.get((tipo, estacion))
+            if cacheado:
+                texto, score = cacheado
+                input_box.fill(texto)
+                opciones, textos = self._leer_sugerencias()
+                if texto in textos:
+                    opciones.nth(textos.index(texto)).click()
+                    print(f"✓ {etiqueta} seleccionado (caché): {texto}")
+                    return texto, score
+                # La sugerencia cacheada ya no aparece: flujo normal
+                input_box.fill("")
+
+            # fill() en vez de teclear carácter a carácter (ya dispara 'input')
+            input_box.fill(estacion)
             print(f"  Buscando sugerencias para '{estacion}'...")
-            self.page.wait_for_timeout(1500)
-
-            opciones = []
-            for sel in self._SELECTORS_SUGERENCIAS:
-                try:
-                    opciones = self.page.locator(sel).all()
-                    if len(opciones) > 0:
-                        break
-                except Exception:
-                    continue
+            opciones, textos = self._leer_sugerencias()
 
-            if not opciones:
+            if not textos:
                 print("⚠ No se encontraron sugerencias")
                 input_box.press("Enter")
                 return estacion, 0.5
 
-            mejor_opcion, score = self.buscar_estacion_aproximada(estacion, opciones)
-            if mejor_opcion:
-                texto = mejor_opcion.inner_text().strip()
+            idx, texto, score = self.buscar_estacion_aproximada(estacion, textos)
+            if idx is not None:
                 print(f"  Mejor coincidencia: '{texto}' (similitud: {score:.2%})")
-                mejor_opcion.click()
+                opciones.nth(idx).click()
                 print(f"✓ {etiqueta} seleccionado: {texto}")
-                time.sleep(0.5)
+                self._station_cache[(tipo, estacion)] = (texto, score)
                 return texto, score
 
             return None, 0.0
@@ -240,21 +600,16 @@ class RenfeScraperPlaywright:
         """Selecciona la fecha por calendario genérico (fallback)."""
         try:
             fecha = datetime.strptime(fecha_str, "%d/%m/%Y")
-            input_fecha = None
-            for selector in self._SELECTORS_INPUT_FECHA:
-                try:
-                    cand = self.page.locator(selector).first
-                    if cand.is_visible(timeout=2000):
-                        input_fecha = cand
-                        break
-                except Exception:
-                    continue
+            input_fecha = self._primer_visible(self._SELECTORS_INPUT_FECHA)
             if not input_fecha:
                 print("✗ No se encontró el campo de fecha")
                 return
 
             input_fecha.click()
-            time.sleep(0.5)
+            try:
+                self.page.locator("[role='grid'], .mat-calendar, .lightpick").first.wait_for(state="visible")
+            except Exception:
+                pass
 
             dia = fecha.day
             for selector in (
@@ -269,7 +624,6 @@ class RenfeScraperPlaywright:
                             if d.inner_text().strip() == str(dia):
                                 d.click()
                                 print(f"✓ Fecha seleccionada: {fecha_str}")
-                                time.sleep(0.5)
                                 return
                 except Exception:
                     continue
@@ -277,116 +631,64 @@ class RenfeScraperPlaywright:
         except Exception as e:
             print(f"✗ Error al seleccionar fecha: {e}")
 
-    def seleccionar_ida_y_fecha(self, fecha_str: str) -> bool:
-        """Versión robusta para calendario Lightpick (solo ida).
-        Mantiene la misma lógica de navegación/selección.
-        """
-        def _parse_fecha(s: str) -> datetime:
-            return datetime.strptime(s.strip(), "%d/%m/%Y")
-
-        def _leer_mes_y_anyo():
-            # 1) <select> (aunque estén disabled)
-            try:
-                opt_mes = self.page.locator(".lightpick__select-months option[selected]").first
-                opt_any = self.page.locator(".lightpick__select-years option[selected]").first
-                if opt_mes.is_visible() and opt_any.is_visible():
-                    mes_txt = opt_mes.inner_text().strip().lower()
-                    anyo_txt = opt_any.inner_text().strip()
-                    if mes_txt in self._MESES and anyo_txt.isdigit():
-                        return self._MESES[mes_txt], int(anyo_txt)
-            except Exception:
-                pass
-            # 2) Etiqueta alternativa
-            try:
-                alt = self.page.locator(".rf-daterange-picker-alternative__month-label").first
-                if alt.is_visible():
-                    mes_txt = alt.locator("span").nth(0).inner_text().strip().lower()
-                    anyo_txt = alt.locator("span").nth(1).inner_text().strip()
-                    if mes_txt in self._MESES and anyo_txt.isdigit():
-                        return self._MESES[mes_txt], int(anyo_txt)
-            except Exception:
-                pass
+    def _leer_mes_y_anyo(self):
+        """(mes, año) visibles en el calendario Lightpick, o None."""
+        # 1) <select> (aunque estén disabled)  2) Etiqueta alternativa
+        try:
+            candidatos = self.page.evaluate(self._JS_LEER_MES_Y_ANYO)
+        except Exception:
             return None
+        return self._mes_y_anyo_de(candidatos)
 
-        def _click_next(n=1):
-            for _ in range(max(0, n)):
-                try:
-                    self.page.locator("button.lightpick__next-action").first.click()
-                    self.page.wait_for_timeout(120)
-                except Exception:
-                    return False
-            return True
-
-        def _click_prev(n=1):
-            for _ in range(max(0, n)):
-                try:
-                    self.page.locator("button.lightpick__previous-action").first.click()
-                    self.page.wait_for_timeout(120)
-                except Exception:
-                    return False
+    def _navegar_meses(self, diff: int, anyo: int, mes: int) -> bool:
+        """Mueve el calendario `diff` meses en un único evaluate."""
+        if diff == 0:
             return True
+        try:
+            return bool(self.page.evaluate(self._JS_NAVEGAR_MES, {"y": anyo, "m": mes, "diff": diff}))
+        except Exception:
+            return False
 
+    def seleccionar_ida_y_fecha(self, fecha_str: str) -> bool:
+        """Versión robusta para calendario Lightpick (solo ida).
+        Mantiene la misma lógica de navegación/selección.
+        """
         try:
-            fecha = _parse_fecha(fecha_str)
+            fecha = datetime.strptime(fecha_str.strip(), "%d/%m/%Y")
             dia = str(fecha.day)
             mes_obj, anyo_obj = fecha.month, fecha.year
+            # Todo lo calculable se hace antes de abrir el calendario
+            hoy = datetime.today()
+            diff_desde_hoy = self._month_diff(hoy.month, hoy.year, mes_obj, anyo_obj)
 
             # 1) Abrir FECHA IDA (selectores tolerantes)
-            openers = (
-                "button:has-text('FECHA IDA')",
-                "label:has-text('FECHA IDA')",
-                "input[placeholder*='Fecha'][placeholder*='ida']",
-                "input[id*='date'][id*='out']",
-                "input[type='text'][placeholder*='Salida']",
-            )
-            opener = None
-            for sel in openers:
-                try:
-                    cand = self.page.locator(sel).first
-                    if cand and cand.is_visible():
-                        opener = cand
-                        break
-                except Exception:
-                    continue
+            opener = self._primer_visible(self._SELECTORS_FECHA_IDA)
             if not opener:
                 print("✗ No se encontró el control para abrir FECHA IDA")
                 return False
 
             opener.click()
-            self.page.locator(".lightpick").first.wait_for(state="visible", timeout=3000)
-            self.page.locator(".lightpick__days").first.wait_for(state="visible", timeout=3000)
+            self.page.locator(self._SEL_CALENDARIO).first.wait_for(state="visible")
+            self.page.locator(self._SEL_DIAS_CALENDARIO).first.wait_for(state="visible")
 
             # 2) Marcar "Viaje solo ida"
             try:
-                self.page.locator("#trip-option label:has-text('Viaje solo ida')").first.click()
-                self.page.wait_for_timeout(120)
+                self.page.locator(self._SEL_VIAJE_SOLO_IDA).first.click()
             except Exception:
                 pass
 
             # 3) Navegar al mes/año objetivo
-            visible = _leer_mes_y_anyo() or (self.page.wait_for_timeout(250) or _leer_mes_y_anyo())
-            if not visible:
-                hoy = datetime.today()
-                diff = self._month_diff(hoy.month, hoy.year, mes_obj, anyo_obj)
-                if diff > 0:
-                    _click_next(diff)
-                elif diff < 0:
-                    _click_prev(-diff)
-            else:
-                mes_vis, anyo_vis = visible
-                diff = self._month_diff(mes_vis, anyo_vis, mes_obj, anyo_obj)
-                if diff > 0:
-                    _click_next(min(diff, 60))
-                elif diff < 0:
-                    _click_prev(min(-diff, 60))
-                self.page.wait_for_timeout(120)
+            try:
+                self.page.locator(self._SEL_MES_VISIBLE).first.wait_for(state="attached")
+            except Exception:
+                pass
+            visible = self._leer_mes_y_anyo()
+            self._navegar_meses(self._meses_a_navegar(visible, fecha, diff_desde_hoy), anyo_obj, mes_obj)
 
             # 4) Seleccionar el día (tres estrategias)
             seleccionado = False
             try:
-                self.page.locator(
-                    f".lightpick__day.is-available:not(.is-previous-month):not(.is-next-month):has-text('{dia}')"
-                ).first.click()
+                self.page.locator(f"{self._SEL_DIAS_DISPONIBLES}:has-text('{dia}')").first.click()
                 seleccionado = True
             except Exception:
                 seleccionado = False
@@ -394,15 +696,7 @@ class RenfeScraperPlaywright:
             if not seleccionado:
                 try:
                     did = self.page.evaluate(
-                        f"""() => {{
-                        const t = new Date({anyo_obj}, {mes_obj-1}, {int(dia)}).setHours(0,0,0,0);
-                        const el = document.querySelector(".lightpick .lightpick__day[data-time='"+t+"']");
-                        if (el && !el.classList.contains('is-previous-month') && !el.classList.contains('is-next-month')) {{
-                            el.click();
-                            return true;
-                        }}
-                        return false;
-                    }}"""
+                        self._JS_CLICK_DIA, {"y": anyo_obj, "m": mes_obj, "d": int(dia)}
                     )
                     if did:
                         seleccionado = True
@@ -411,9 +705,7 @@ class RenfeScraperPlaywright:
 
             if not seleccionado:
                 try:
-                    dias_loc = self.page.locator(
-                        ".lightpick__day.is-available:not(.is-previous-month):not(.is-next-month)"
-                    )
+                    dias_loc = self.page.locator(self._SEL_DIAS_DISPONIBLES)
                     count = dias_loc.count()
                     for i in range(count):
                         dloc = dias_loc.nth(i)
@@ -436,14 +728,17 @@ class RenfeScraperPlaywright:
 
             # 5) Pulsar 'Aceptar' si está
             try:
-                btn_ok = self.page.locator("button.lightpick__apply-action-sub").first
+                btn_ok = self.page.locator(self._SEL_ACEPTAR_FECHA).first
                 if btn_ok and btn_ok.is_visible():
                     btn_ok.click()
             except Exception:
                 pass
 
             print(f"✓ Fecha (solo ida) seleccionada: {fecha_str}")
-            self.page.wait_for_timeout(150)
+            try:
+                self.page.locator(self._SEL_CALENDARIO).first.wait_for(state="hidden")
+            except Exception:
+                pass
             return True
 
         except Exception as e:
@@ -452,70 +747,21 @@ class RenfeScraperPlaywright:
 
     # --------------------------------- Resultados -------------------------------- #
     def _extraer_trayectos_ida(self):
-        """Devuelve lista de dicts con 'salida', 'llegada' y 'estado' (OK/LLENO/DESCONOCIDO)."""
-        viajes = []
+        """Devuelve lista de dicts con 'salida', 'llegada', 'estado' (OK/LLENO/DESCONOCIDO)
+        y 'salida_min' (minutos desde medianoche, precalculado para comparar horas).
+        """
         try:
-            filas = self.page.locator("#listaTrenesTBodyIda .row.selectedTren")
-            n = filas.count()
-            for i in range(n):
-                fila = filas.nth(i)
-
-                horas = fila.locator(".col-md-8.trenes h5")
-                if horas.count() < 2:
-                    continue
-                txt_salida = horas.nth(0).inner_text().strip()
-                txt_llegada = horas.nth(horas.count() - 1).inner_text().strip()
-                m1 = re.search(r"\b\d{2}:\d{2}\b", txt_salida)
-                m2 = re.search(r"\b\d{2}:\d{2}\b", txt_llegada)
-                if not (m1 and m2):
-                    continue
-
-                has_precio = fila.locator(".precio-final").count() > 0
-                has_plaza_h = fila.locator(f".plazas-h, #ahorro_tren_i_{i+1} .accessiblechair").count() > 0
-
-                if has_precio:
-                    estado = "OK"
-                elif has_plaza_h:
-                    estado = "LLENO"
-                else:
-                    estado = "DESCONOCIDO"
-
-                viajes.append({
-                    "salida": m1.group(0),
-                    "llegada": m2.group(0),
-                    "estado": estado,
-                })
-            return viajes
+            filas = self.page.locator(self._SEL_FILAS_IDA).evaluate_all(self._JS_FILAS_IDA)
+            return self._parsear_filas(filas)
         except Exception as e:
             print(f"⚠ Error extrayendo trayectos: {e}")
             return []
 
-    def imprimir_trayectos(self, origen: str, destino: str, viajes):
-        """Imprime lista numerada de trayectos (IDA)."""
-        if not viajes:
-            print("⚠ No se encontraron trayectos para mostrar.")
-            return
-
-        print("\n🧾 LISTADO DE TRAYECTOS (IDA)")
-        for idx, v in enumerate(viajes, start=1):
-            if v.get("estado") == "OK":
-                estado_str = "TREN OK ✓"
-            elif v.get("estado") == "LLENO":
-                estado_str = "TREN LLENO ✗"
-            else:
-                estado_str = "ESTADO DESCONOCIDO ?"
-            print(f"{idx}. {origen} → {destino} | salida {v['salida']} | llegada {v['llegada']} | {estado_str}")
-
     # ------------------------------- Búsquedas/Checks ---------------------------- #
     def buscar_billetes(self, origen: str, destino: str, fecha: str):
         """Ejecuta la búsqueda completa y devuelve dict con metadatos/resultados."""
-        resultado = {
-            "ok": False,
-            "origen_seleccionado": None,
-            "destino_seleccionado": None,
-            "fecha": fecha,
-            "url": None,
-        }
+        resultado = self._resultado_busqueda(fecha)
+        self._last_query, self._last_viajes = None, []
         try:
             print("\n" + "=" * 50)
             print("BÚSQUEDA DE BILLETES RENFE - PLAYWRIGHT")
@@ -523,14 +769,18 @@ class RenfeScraperPlaywright:
 
             # 1) Navegar
             print("\n1. Navegando a Renfe...")
-            self.page.goto("https://www.renfe.com/es/es", wait_until="networkidle")
-            time.sleep(0.3)
+            self.page.goto(self._URL_RENFE, wait_until="domcontentloaded")
+            # Espera dirigida al formulario en vez de a que callen todas las peticiones
+            self._primer_visible(self._SELECTORS_INPUT_ORIGEN, timeout=max(self.default_timeout_ms, 8000))
 
             # 2) Cookies
             print("\n2. Gestionando cookies...")
             self.aceptar_cookies()
 
             # 3) Origen
+            # Origen y destino van en serie a propósito: ambos autocompletados
+            # necesitan el foco del teclado y comparten el desplegable de
+            # sugerencias, así que rellenarlos a la vez mezclaría las opciones.
             print(f"\n3. Rellenando ORIGEN: {origen}")
             origen_sel, score_origen = self.rellenar_estacion("origin", origen)
             resultado["origen_seleccionado"] = (origen_sel, score_origen)
@@ -548,23 +798,23 @@ class RenfeScraperPlaywright:
 
             # 7) Buscar
             print("\n7. Buscando billetes...")
-            for selector in self._SELECTORS_BUSCAR:
+            boton = self._primer_visible(self._SELECTORS_BUSCAR)
+            if boton:
                 try:
-                    boton = self.page.locator(selector).first
-                    if boton.is_visible(timeout=2000):
-                        boton.click()
-                        print("✓ Búsqueda iniciada")
-                        break
+                    boton.click()
+                    print("✓ Búsqueda iniciada")
                 except Exception:
-                    continue
+                    pass
 
             print("⏳ Esperando resultados...")
-            self.page.wait_for_selector("#listaTrenesTBodyIda .row.selectedTren", timeout=20000)
+            self.page.wait_for_selector(self._SEL_FILAS_IDA, timeout=20000)
 
             resultado["url"] = self.page.url
             resultado["ok"] = True
 
             viajes = self._extraer_trayectos_ida()
+            resultado["viajes"] = viajes
+            self._last_query, self._last_viajes = (origen, destino, fecha), viajes
             origen_print = (resultado["origen_seleccionado"][0] or f"{origen}")
             destino_print = (resultado["destino_seleccionado"][0] or f"{destino}")
             self.imprimir_trayectos(origen_print, destino_print, viajes)
@@ -590,64 +840,25 @@ class RenfeScraperPlaywright:
         Retorna dict con: ok, estado ('OK'|'LLENO'|'DESCONOCIDO'|'NO_ENCONTRADO'),
         salida, llegada, url.
         """
-        resultado = {
-            "ok": False,
-            "estado": "NO_ENCONTRADO",
-            "salida": None,
-            "llegada": None,
-            "url": None,
-        }
+        resultado = self._resultado_check()
         try:
-            busc = self.buscar_billetes(origen=origen, destino=destino, fecha=fecha)
-            resultado["url"] = busc.get("url")
-            if not busc.get("ok"):
-                if imprimir:
-                    print("✗ No se pudo completar la búsqueda previa.")
-                return resultado
-
-            viajes = self._extraer_trayectos_ida()
-
-            mejor, mejor_diff = None, 10**9
-            for v in viajes:
-                if "salida" not in v:
-                    continue
-                diff = self._min_diff(v["salida"], hora_objetivo)
-                if diff <= tolerancia_min and diff < mejor_diff:
-                    mejor, mejor_diff = v, diff
-
-            if mejor is None:
-                for v in viajes:
-                    if v.get("salida") == hora_objetivo:
-                        mejor = v
-                        break
-
-            if mejor is None:
-                if imprimir:
-                    print(f"⚠ No se encontró tren con salida {hora_objetivo} (±{tolerancia_min} min).")
+            if (origen, destino, fecha) == self._last_query:
+                resultado["url"] = self.page.url
+                viajes = self._last_viajes
+            else:
+                busc = self.buscar_billetes(origen=origen, destino=destino, fecha=fecha)
+                resultado["url"] = busc.get("url")
+                if not busc.get("ok"):
+                    if imprimir:
+                        print("✗ No se pudo completar la búsqueda previa.")
+                    return resultado
+                viajes = busc["viajes"]
+
+            if not self._completar_check(resultado, viajes, hora_objetivo, tolerancia_min, imprimir):
                 return resultado
 
-            resultado.update(
-                {
-                    "ok": True,
-                    "estado": mejor.get("estado", "DESCONOCIDO"),
-                    "salida": mejor.get("salida"),
-                    "llegada": mejor.get("llegada"),
-                }
-            )
-
             if imprimir:
-                if resultado["estado"] == "OK":
-                    print(
-                        f"✓ {origen} → {destino} | {fecha} {resultado['salida']}–{resultado['llegada']} · TREN OK"
-                    )
-                elif resultado["estado"] == "LLENO":
-                    print(
-                        f"✗ {origen} → {destino} | {fecha} {resultado['salida']}–{resultado['llegada']} · TREN LLENO"
-                    )
-                else:
-                    print(
-                        f"? {origen} → {destino} | {fecha} {resultado['salida']}–{resultado['llegada']} · ESTADO DESCONOCIDO"
-                    )
+                self._imprimir_check(origen, destino, fecha, resultado)
 
             return resultado
 
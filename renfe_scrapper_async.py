@@ -0,0 +1,445 @@
+"""
+Scraper de Renfe usando la API asíncrona de Playwright
+Mismo flujo que renfe_scrapper.RenfeScraperPlaywright, pero con `await`
+para poder ejecutarse directamente en el event loop del bot (sin hilos).
+Selectores, JS y utilidades puras vienen de renfe_scrapper.RenfeScraperBase.
+"""
+
+import json
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from playwright.async_api import async_playwright
+
+from renfe_scrapper import _LAUNCH_ARGS, RenfeScraperBase
+
+
+@asynccontextmanager
+async def lanzar_navegador(headless: bool = True):
+    """Abre un Chromium compartido para varios scrapers (un contexto por carril)."""
+    async with async_playwright() as pw:
+        browser = await pw.chromium.launch(headless=headless, args=_LAUNCH_ARGS)
+        try:
+            yield browser
+        finally:
+            await browser.close()
+
+
+class RenfeScraperPlaywrightAsync(RenfeScraperBase):
+    """Versión async del scraper (solo `async with`).
+
+    Hereda de RenfeScraperBase constantes, selectores y utilidades puras;
+    aquí solo están los métodos de navegador que usan buscar_billetes y
+    esta_lleno_en_hora (los fallbacks sin uso de la versión síncrona, como
+    seleccionar_fecha o seleccionar_solo_ida, no se portan). Si se pasa
+    `browser`, se abre un contexto propio sobre él y no se cierra al salir.
+    """
+
+    def __init__(
+        self,
+        headless: bool = True,
+        default_timeout_ms: int = 3000,
+        block_assets: bool = True,
+        storage_state_path="renfe_state.json",
+        browser=None,
+    ):
+        super().__init__(
+            headless=headless,
+            default_timeout_ms=default_timeout_ms,
+            block_assets=block_assets,
+            storage_state_path=storage_state_path,
+        )
+        self._browser_externo = browser
+
+    # ------------------------------- Inicialización ------------------------------ #
+    async def __aenter__(self):
+        if self._browser_externo is None:
+            self.playwright = await async_playwright().start()
+            self.browser = await self.playwright.chromium.launch(headless=self.headless, args=_LAUNCH_ARGS)
+        else:
+            self.browser = self._browser_externo
+        estado = None
+        if self.storage_state_path and self.storage_state_path.exists():
+            estado = str(self.storage_state_path)
+        try:
+            self.context = await self.browser.new_context(viewport=self._VIEWPORT, storage_state=estado)
+            self._estado_cargado = estado is not None
+        except Exception:
+            # Estado corrupto o ilegible: contexto limpio
+            self.context = await self.browser.new_context(viewport=self._VIEWPORT)
+        self.page = await self.context.new_page()
+        # Un único timeout para esperas/acciones; la navegación necesita más margen
+        self.page.set_default_timeout(self.default_timeout_ms)
+        self.page.set_default_navigation_timeout(max(self.default_timeout_ms, 15000))
+        if self.block_assets:
+            await self.page.route("**/*", self._filtrar_recursos)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self.context:
+            if self.storage_state_path:
+                await self._guardar_estado()
+            await self.context.close()
+        if self._browser_externo is None:
+            if self.browser:
+                await self.browser.close()
+            if self.playwright:
+                await self.playwright.stop()
+
+    async def _guardar_estado(self):
+        """Guarda cookies/localStorage con escritura atómica (varios scrapers a la vez)."""
+        try:
+            estado = await self.context.storage_state()
+            tmp = self._ruta_estado_tmp()
+            tmp.write_text(json.dumps(estado), encoding="utf-8")
+            os.replace(tmp, self.storage_state_path)
+        except Exception as e:
+            print(f"⚠ No se pudo guardar el estado del navegador: {e}")
+
+    async def _filtrar_recursos(self, route):
+        """Aborta imágenes/fuentes/media y analítica; deja pasar el resto."""
+        if self._debe_bloquear(route.request):
+            await route.abort()
+        else:
+            await route.continue_()
+
+    # ------------------------------- Utilidades -------------------------------- #
+    async def _primer_visible(self, selectores, timeout=None):
+        """Primer elemento visible de los selectores, en una sola espera.
+
+        Se espera a la unión de todos y después se elige respetando el orden
+        de la tupla (específicos primero), no el orden del DOM. Retorna el
+        locator, o None si ninguno aparece dentro del timeout (el de la
+        página si no se indica).
+        """
+        union = self._union_visibles(selectores)
+        try:
+            await union.wait_for(state="visible", timeout=timeout)
+        except Exception:
+            return None
+        for cand in self._visibles(selectores):
+            try:
+                if await cand.count() > 0:
+                    return cand.first
+            except Exception:
+                continue
+        return union  # desapareció entre la espera y el conteo: lo que casó en la espera
+
+    # ---------------------------------- Cookies ---------------------------------- #
+    async def aceptar_cookies(self):
+        """Acepta cookies si aparecen (varios selectores tolerantes)."""
+        try:
+            if self._estado_cargado and await self.page.locator(", ".join(self._SELECTORS_COOKIES)).count() == 0:
+                print("✓ Cookies ya aceptadas (estado guardado)")
+                return
+            boton = await self._primer_visible(self._SELECTORS_COOKIES)
+            if not boton:
+                print("⚠ No se encontró banner de cookies")
+                return
+            await boton.click()
+            print("✓ Cookies aceptadas")
+            try:
+                await boton.wait_for(state="hidden")
+            except Exception:
+                pass
+        except Exception as e:
+            print(f"⚠ Error con cookies: {e}")
+
+    # ------------------------------- Autocompletado ------------------------------ #
+    async def _resolver_input_y_sugerencias(self, tipo: str, etiqueta: str):
+        """Retorna (input_locator, lista_opciones) con selectores tolerantes."""
+        input_selectors = self._SELECTORS_INPUT_ORIGEN if tipo == "origin" else self._SELECTORS_INPUT_DESTINO
+
+        input_box = await self._primer_visible(input_selectors)
+        if not input_box:
+            print(f"✗ No se encontró el campo de {etiqueta}")
+            return None, []
+
+        await input_box.click()
+        await input_box.fill("")
+        return input_box, []
+
+    async def _leer_sugerencias(self):
+        """Espera al desplegable y retorna (locator_opciones, textos) o (None, [])."""
+        try:
+            await self._union_visibles(self._SELECTORS_SUGERENCIAS).wait_for(state="visible")
+        except Exception:
+            pass  # sin desplegable: el llamador lo trata como "sin sugerencias"
+
+        for sel in self._SELECTORS_SUGERENCIAS:
+            try:
+                loc = self.page.locator(sel)
+                textos = [t.strip() for t in await loc.all_inner_texts()]
+                if textos:
+                    return loc, textos
+            except Exception:
+                continue
+        return None, []
+
+    async def rellenar_estacion(self, tipo: str, estacion: str):
+        """Rellena origen/destino con heurística de autocompletado tolerante."""
+        try:
+            etiqueta = "Origen" if tipo == "origin" else "Destino"
+            print(f"  Buscando campo de {etiqueta}...")
+
+            input_box, _ = await self._resolver_input_y_sugerencias(tipo, etiqueta)
+            if not input_box:
+                return None, 0.0
+
+            cacheado = self._station_cache.get((tipo, estacion))
+            if cacheado:
+                texto, score = cacheado
+                await input_box.fill(texto)
+                opciones, textos = await self._leer_sugerencias()
+                if texto in textos:
+                    await opciones.nth(textos.index(texto)).click()
+                    print(f"✓ {etiqueta} seleccionado (caché): {texto}")
+                    return texto, score
+                # La sugerencia cacheada ya no aparece: flujo normal
+                await input_box.fill("")
+
+            await input_box.fill(estacion)
+            print(f"  Buscando sugerencias para '{estacion}'...")
+            opciones, textos = await self._leer_sugerencias()
+
+            if not textos:
+                print("⚠ No se encontraron sugerencias")
+                await input_box.press("Enter")
+                return estacion, 0.5
+
+            idx, texto, score = self.buscar_estacion_aproximada(estacion, textos)
+            if idx is not None:
+                print(f"  Mejor coincidencia: '{texto}' (similitud: {score:.2%})")
+                await opciones.nth(idx).click()
+                print(f"✓ {etiqueta} seleccionado: {texto}")
+                self._station_cache[(tipo, estacion)] = (texto, score)
+                return texto, score
+
+            return None, 0.0
+
+        except Exception as e:
+            print(f"✗ Error al rellenar {tipo}: {e}")
+            import traceback
+            traceback.print_exc()
+            return None, 0.0
+
+    # -------------------------------- Calendarios -------------------------------- #
+    async def _leer_mes_y_anyo(self):
+        """(mes, año) visibles en el calendario Lightpick, o None."""
+        try:
+            candidatos = await self.page.evaluate(self._JS_LEER_MES_Y_ANYO)
+        except Exception:
+            return None
+        return self._mes_y_anyo_de(candidatos)
+
+    async def _navegar_meses(self, diff: int, anyo: int, mes: int) -> bool:
+        """Mueve el calendario `diff` meses en un único evaluate."""
+        if diff == 0:
+            return True
+        try:
+            return bool(await self.page.evaluate(self._JS_NAVEGAR_MES, {"y": anyo, "m": mes, "diff": diff}))
+        except Exception:
+            return False
+
+    async def seleccionar_ida_y_fecha(self, fecha_str: str) -> bool:
+        """Versión robusta para calendario Lightpick (solo ida)."""
+        try:
+            fecha = datetime.strptime(fecha_str.strip(), "%d/%m/%Y")
+            dia = str(fecha.day)
+            mes_obj, anyo_obj = fecha.month, fecha.year
+            # Todo lo calculable se hace antes de abrir el calendario
+            hoy = datetime.today()
+            diff_desde_hoy = self._month_diff(hoy.month, hoy.year, mes_obj, anyo_obj)
+
+            # 1) Abrir FECHA IDA (selectores tolerantes)
+            opener = await self._primer_visible(self._SELECTORS_FECHA_IDA)
+            if not opener:
+                print("✗ No se encontró el control para abrir FECHA IDA")
+                return False
+
+            await opener.click()
+            await self.page.locator(self._SEL_CALENDARIO).first.wait_for(state="visible")
+            await self.page.locator(self._SEL_DIAS_CALENDARIO).first.wait_for(state="visible")
+
+            # 2) Marcar "Viaje solo ida"
+            try:
+                await self.page.locator(self._SEL_VIAJE_SOLO_IDA).first.click()
+            except Exception:
+                pass
+
+            # 3) Navegar al mes/año objetivo
+            try:
+                await self.page.locator(self._SEL_MES_VISIBLE).first.wait_for(state="attached")
+            except Exception:
+                pass
+            visible = await self._leer_mes_y_anyo()
+            await self._navegar_meses(self._meses_a_navegar(visible, fecha, diff_desde_hoy), anyo_obj, mes_obj)
+
+            # 4) Seleccionar el día (tres estrategias)
+            seleccionado = False
+            try:
+                await self.page.locator(f"{self._SEL_DIAS_DISPONIBLES}:has-text('{dia}')").first.click()
+                seleccionado = True
+            except Exception:
+                seleccionado = False
+
+            if not seleccionado:
+                try:
+                    if await self.page.evaluate(self._JS_CLICK_DIA, {"y": anyo_obj, "m": mes_obj, "d": int(dia)}):
+                        seleccionado = True
+                except Exception:
+                    pass
+
+            if not seleccionado:
+                try:
+                    dias_loc = self.page.locator(self._SEL_DIAS_DISPONIBLES)
+                    for i in range(await dias_loc.count()):
+                        dloc = dias_loc.nth(i)
+                        if not await dloc.is_visible():
+                            continue
+                        try:
+                            txt = (await dloc.inner_text()).strip()
+                        except Exception:
+                            continue
+                        if txt == dia:
+                            await dloc.click(force=True)
+                            seleccionado = True
+                            break
+                except Exception:
+                    pass
+
+            if not seleccionado:
+                print(f"⚠ No se pudo seleccionar el día {dia}")
+                return False
+
+            # 5) Pulsar 'Aceptar' si está
+            try:
+                btn_ok = self.page.locator(self._SEL_ACEPTAR_FECHA).first
+                if await btn_ok.is_visible():
+                    await btn_ok.click()
+            except Exception:
+                pass
+
+            print(f"✓ Fecha (solo ida) seleccionada: {fecha_str}")
+            try:
+                await self.page.locator(self._SEL_CALENDARIO).first.wait_for(state="hidden")
+            except Exception:
+                pass
+            return True
+
+        except Exception as e:
+            print(f"✗ Error en seleccionar_ida_y_fecha (Lightpick): {e}")
+            return False
+
+    # --------------------------------- Resultados -------------------------------- #
+    async def _extraer_trayectos_ida(self):
+        """Igual que la versión síncrona: lista de trayectos de la tabla de IDA."""
+        try:
+            filas = await self.page.locator(self._SEL_FILAS_IDA).evaluate_all(
+                self._JS_FILAS_IDA
+            )
+            return self._parsear_filas(filas)
+        except Exception as e:
+            print(f"⚠ Error extrayendo trayectos: {e}")
+            return []
+
+    # ------------------------------- Búsquedas/Checks ---------------------------- #
+    async def buscar_billetes(self, origen: str, destino: str, fecha: str):
+        """Ejecuta la búsqueda completa y devuelve dict con metadatos/resultados."""
+        resultado = self._resultado_busqueda(fecha)
+        self._last_query, self._last_viajes = None, []
+        try:
+            print("\n" + "=" * 50)
+            print("BÚSQUEDA DE BILLETES RENFE - PLAYWRIGHT (async)")
+            print("=" * 50)
+
+            # 1) Navegar
+            print("\n1. Navegando a Renfe...")
+            await self.page.goto(self._URL_RENFE, wait_until="domcontentloaded")
+            await self._primer_visible(self._SELECTORS_INPUT_ORIGEN, timeout=max(self.default_timeout_ms, 8000))
+
+            # 2) Cookies
+            print("\n2. Gestionando cookies...")
+            await self.aceptar_cookies()
+
+            # 3) Origen / 4) Destino (en serie: comparten foco y desplegable)
+            print(f"\n3. Rellenando ORIGEN: {origen}")
+            resultado["origen_seleccionado"] = await self.rellenar_estacion("origin", origen)
+
+            print(f"\n4. Rellenando DESTINO: {destino}")
+            resultado["destino_seleccionado"] = await self.rellenar_estacion("destination", destino)
+
+            # 5) Solo ida + Fecha
+            print(f"\n5. Seleccionando SOLO IDA y FECHA: {fecha}")
+            if not await self.seleccionar_ida_y_fecha(fecha):
+                print("⚠ No se pudo terminar la selección de fecha en modo solo ida")
+
+            # 7) Buscar
+            print("\n7. Buscando billetes...")
+            boton = await self._primer_visible(self._SELECTORS_BUSCAR)
+            if boton:
+                try:
+                    await boton.click()
+                    print("✓ Búsqueda iniciada")
+                except Exception:
+                    pass
+
+            print("⏳ Esperando resultados...")
+            await self.page.wait_for_selector(self._SEL_FILAS_IDA, timeout=20000)
+
+            resultado["url"] = self.page.url
+            resultado["ok"] = True
+
+            viajes = await self._extraer_trayectos_ida()
+            resultado["viajes"] = viajes
+            self._last_query, self._last_viajes = (origen, destino, fecha), viajes
+            origen_print = (resultado["origen_seleccionado"][0] or f"{origen}")
+            destino_print = (resultado["destino_seleccionado"][0] or f"{destino}")
+            self.imprimir_trayectos(origen_print, destino_print, viajes)
+
+        except Exception as e:
+            print(f"\n✗ Error: {e}")
+            import traceback
+            traceback.print_exc()
+
+        return resultado
+
+    async def esta_lleno_en_hora(
+        self,
+        origen: str,
+        destino: str,
+        fecha: str,
+        hora_objetivo: str,
+        tolerancia_min: int = 0,
+        imprimir: bool = True,
+    ):
+        """Comprueba si un tren concreto está lleno en la fecha/hora dadas.
+
+        Retorna dict con: ok, estado ('OK'|'LLENO'|'DESCONOCIDO'|'NO_ENCONTRADO'),
+        salida, llegada, url.
+        """
+        resultado = self._resultado_check()
+        try:
+            if (origen, destino, fecha) == self._last_query:
+                resultado["url"] = self.page.url
+                viajes = self._last_viajes
+            else:
+                busc = await self.buscar_billetes(origen=origen, destino=destino, fecha=fecha)
+                resultado["url"] = busc.get("url")
+                if not busc.get("ok"):
+                    if imprimir:
+                        print("✗ No se pudo completar la búsqueda previa.")
+                    return resultado
+                viajes = busc["viajes"]
+
+            if not self._completar_check(resultado, viajes, hora_objetivo, tolerancia_min, imprimir):
+                return resultado
+            if imprimir:
+                self._imprimir_check(origen, destino, fecha, resultado)
+            return resultado
+
+        except Exception as e:
+            if imprimir:
+                print(f"✗ Error en esta_lleno_en_hora: {e}")
+            return resultado
@@ -10,6 +10,7 @@
 #
 # Persistencia: ./monitored_trains.json (por chat_id)
 # Token: .env (TELEGRAM_TOKEN)
+# Webhook (opcional): TG_WEBHOOK_URL, TG_WEBHOOK_PATH, TG_WEBHOOK_SECRET, PORT
 # ------------------------------------------------------------
 
 from __future__ import annotations
@@ -17,15 +18,20 @@ import asyncio
 import json
 import os
 import re
-import threading
+from collections import defaultdict
 from dataclasses import dataclass, asdict, field
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, KeysView, List, Optional, Tuple
+from zoneinfo import ZoneInfo
 
-import pytz
 from dotenv import load_dotenv
-from telegram import ReplyKeyboardRemove, Update
+
+try:  # orjson (Rust) si está disponible; si no, json estándar
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+from telegram import Bot, ReplyKeyboardRemove, Update
 from telegram.constants import ParseMode
 from telegram.ext import (
     AIORateLimiter,
@@ -39,21 +45,28 @@ from telegram.ext import (
 )
 
 # Usa tu scraper real
-from renfe_scrapper import RenfeScraperPlaywright 
+from renfe_scrapper_async import RenfeScraperPlaywrightAsync, lanzar_navegador
+
+MD = ParseMode.MARKDOWN  # alias para no resolver el enum en cada respuesta
 
 
 # ========================== Configuración general =========================== #
 load_dotenv()
-TZ_MADRID = pytz.timezone("Europe/Madrid")
+TZ_MADRID = ZoneInfo("Europe/Madrid")
 DATA_FILE = Path("monitored_trains.json")
-STORE_LOCK = threading.Lock()
+STORE_LOCK = asyncio.Lock()  # todo corre en el event loop: no hace falta un mutex de hilos
 
 MONITOR_CHAT_NOTIFICATIONS = False
 
+# Máximo de búsquedas Playwright simultáneas (comprobación periódica y /m).
+# La comprobación periódica pide el permiso por búsqueda, así que /m nunca
+# espera más que una búsqueda en curso.
+SCRAPE_CONCURRENCY = max(1, int(os.getenv("SCRAPE_CONCURRENCY", "2")))
+SCRAPE_SEM = asyncio.Semaphore(SCRAPE_CONCURRENCY)
+
 # Estados conversación
 ASK_ORIGIN, ASK_DEST, ASK_DATE, CHOOSE_TRAIN = range(4)
 DEL_CHOOSE = 100  # estado de borrado
-DATE_RE = re.compile(r"^\d{2}/\d{2}/\d{4}$")  # dd/mm/YYYY
 
 # Filtro para cancelar en cualquier momento
 STOP_FILTER = filters.Regex(r"(?i)^(/?stop)$")
@@ -70,6 +83,16 @@ class MonitoredTrain:
     salida: str         # "HH:MM"
     tolerancia_min: int = 5
     added_at: str = field(default_factory=lambda: datetime.now(TZ_MADRID).isoformat())
+    # (yyyymmdd, hhmm) calculado una vez; no se persiste en el JSON
+    sort_key: Tuple[int, int] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.sort_key = parse_sort_key(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = asdict(self)
+        d.pop("sort_key", None)
+        return d
 
 
 class Store:
@@ -77,39 +100,87 @@ class Store:
 
     def __init__(self, path: Path):
         self.path = path
+        # (firma del fichero, datos): evita releer/parsear si no ha cambiado.
+        # La lista cacheada es de solo lectura para los llamadores.
+        self._cache: Optional[Tuple[Tuple[int, int], List[Dict[str, Any]]]] = None
+        # Índice chat_id -> filas, ligado a la lista cacheada de la que se construyó
+        self._by_chat: Optional[Tuple[List[Dict[str, Any]], Dict[int, List[Dict[str, Any]]]]] = None
+
+    def _firma(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = self.path.stat()
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
 
     def _load(self) -> List[Dict[str, Any]]:
-        if not self.path.exists():
+        firma = self._firma()
+        if firma is None:
             return []
+        cache = self._cache
+        if cache is not None and cache[0] == firma:
+            return cache[1]
         try:
-            return json.loads(self.path.read_text(encoding="utf-8"))
+            raw = self.path.read_bytes()
+            data = orjson.loads(raw) if orjson else json.loads(raw.decode("utf-8"))
         except Exception:
             return []
+        self._cache = (firma, data)
+        return data
 
     def _save(self, data: List[Dict[str, Any]]) -> None:
-        self.path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        if orjson:
+            raw = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+        else:
+            raw = json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+        # Escritura atómica: un corte a mitad no deja el JSON truncado
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        firma = self._firma()
+        self._cache = (firma, data) if firma is not None else None
+
+    def _index_by_chat(self) -> Dict[int, List[Dict[str, Any]]]:
+        """Índice por chat; se reconstruye solo cuando cambia la lista cacheada."""
+        data = self._load()
+        idx = self._by_chat
+        if idx is not None and idx[0] is data:
+            return idx[1]
+        by_chat: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        for d in data:
+            if isinstance(d, dict):  # filas corruptas/legado: se ignoran, como en _list_all_items
+                by_chat[d.get("chat_id")].append(d)
+        self._by_chat = (data, by_chat)
+        return by_chat
+
+    def chat_ids(self) -> KeysView[int]:
+        """Chats con al menos un viaje guardado (vista sobre el índice)."""
+        return self._index_by_chat().keys()
 
     def list_for_chat(self, chat_id: int) -> List[MonitoredTrain]:
-        data = self._load()
-        return [MonitoredTrain(**d) for d in data if d.get("chat_id") == chat_id]
+        return [MonitoredTrain(**d) for d in self._index_by_chat().get(chat_id, ())]
 
-    def add(self, item: MonitoredTrain) -> None:
-        with STORE_LOCK:
+    async def add(self, item: MonitoredTrain) -> None:
+        async with STORE_LOCK:
             data = self._load()
             # Evitar duplicado exacto por id
             data = [d for d in data if d.get("id") != item.id]
-            data.append(asdict(item))
+            data.append(item.to_dict())
             self._save(data)
 
-    def remove_ids(self, ids: List[str]) -> int:
+    async def remove_ids(self, ids: List[str]) -> int:
         """Elimina por id; devuelve cuántos elementos fueron eliminados."""
-        with STORE_LOCK:
+        async with STORE_LOCK:
             data = self._load()
-            before = len(data)
             ids_set = set(ids)
-            data = [d for d in data if d.get("id") not in ids_set]
-            self._save(data)
-            return before - len(data)
+            restantes = [d for d in data if d.get("id") not in ids_set]
+            if len(restantes) == len(data):
+                return 0  # nada que borrar: no se reescribe el fichero
+            self._save(restantes)
+            return len(data) - len(restantes)
 
 
 STORE = Store(DATA_FILE)
@@ -118,7 +189,8 @@ STORE = Store(DATA_FILE)
 ########################3
 # --- Añadidos para comprobación periódica ---
 import random
-from datetime import timedelta
+
+_SALIDA_RE = re.compile(r"\b(\d{2}:\d{2})\b")  # HH:MM dentro del id
 
 def _parse_salida_from_id(item_id: str) -> Optional[str]:
     """
@@ -127,30 +199,35 @@ def _parse_salida_from_id(item_id: str) -> Optional[str]:
     """
     try:
         # Busca un patrón HH:MM dentro del id
-        m = re.search(r"\b(\d{2}:\d{2})\b", item_id)
+        m = _SALIDA_RE.search(item_id)
         return m.group(1) if m else None
     except Exception:
         return None
 
-def _list_all_items() -> List[MonitoredTrain]:
+_CAMPOS_OBLIGATORIOS = ("id", "chat_id", "origen", "destino", "fecha")
+
+def _list_all_items() -> List[Dict[str, Any]]:
     """
     Lee TODOS los viajes del JSON sin filtrar por chat.
-    Usa el Store existente.
+    Devuelve los dicts tal cual (sin construir MonitoredTrain: en cada tick
+    solo se leen unos pocos campos), con 'salida' y 'tolerancia_min' rellenos.
     """
     raw = STORE._load()  # lectura ya usada internamente por Store
-    items: List[MonitoredTrain] = []
+    items: List[Dict[str, Any]] = []
     for d in raw:
-        try:
-            # Relleno defensivo de 'salida' si falta
-            if "salida" not in d or not d["salida"]:
-                d["salida"] = _parse_salida_from_id(d.get("id", "")) or "00:00"
-            items.append(MonitoredTrain(**d))
-        except Exception:
-            # Si por algún motivo no cuadra el esquema, ignoro esa entrada
+        # Si por algún motivo no cuadra el esquema, ignoro esa entrada
+        if not isinstance(d, dict) or any(k not in d for k in _CAMPOS_OBLIGATORIOS):
             continue
+        # Relleno defensivo (copia: la caché es de solo lectura)
+        if not d.get("salida") or "tolerancia_min" not in d:
+            d = dict(d)
+            if not d.get("salida"):
+                d["salida"] = _parse_salida_from_id(d.get("id", "")) or "00:00"
+            d.setdefault("tolerancia_min", 5)
+        items.append(d)
     return items
 
-async def _check_once_and_notify(context: CallbackContext) -> None:
+async def _check_once_and_notify(bot: Bot) -> None:
     """
     Hace UNA pasada de comprobación sobre todos los viajes guardados.
     - Si un viaje pasa a 'OK', se notifica y se elimina del JSON.
@@ -161,94 +238,142 @@ async def _check_once_and_notify(context: CallbackContext) -> None:
         print("⏳ No hay viajes monitorizados en este momento.")
         return  # 👈 importante: salir aquí
 
+    # Chats implicados, del índice del Store (copia: el borrado de abajo lo invalida).
+    # Solo hacen falta para los avisos por chat, desactivados por defecto.
+    chats: List[int] = list(STORE.chat_ids()) if MONITOR_CHAT_NOTIFICATIONS else []
+
     # ---- Log de inicio (consola) ----
     print("🔎 Inicializando monitorización para:")
     for it in items:
-        print(f"   - {it.origen} → {it.destino} | {it.fecha} {it.salida} | tolerancia {it.tolerancia_min}min")
+        print(f"   - {it['origen']} → {it['destino']} | {it['fecha']} {it['salida']} | tolerancia {it['tolerancia_min']}min")
 
     # ---- Aviso de inicio por chat (opcional) ----
     if MONITOR_CHAT_NOTIFICATIONS:
-        chats = {it.chat_id for it in items}
         for chat in chats:
             try:
-                await context.bot.send_message(
+                await bot.send_message(
                     chat_id=chat,
                     text="🔎 Iniciando monitorización de tus viajes guardados..."
                 )
             except Exception as e:
                 print(f"⚠️ No pude enviar aviso de inicio al chat {chat}: {e}")
 
-    # ---- Scraping (uno por viaje, en hilo) ----
-    async def _check_item(it: MonitoredTrain) -> Tuple[MonitoredTrain, Optional[Dict[str, Any]]]:
-        def _task():
-            with RenfeScraperPlaywright(headless=True) as s:
-                return s.esta_lleno_en_hora(
-                    origen=it.origen,
-                    destino=it.destino,
-                    fecha=it.fecha,            # dd/mm/YYYY
-                    hora_objetivo=it.salida,   # HH:MM
-                    tolerancia_min=it.tolerancia_min,
-                    imprimir=False,
-                )
+    # ---- Agrupar viajes idénticos: se comprueban una sola vez ----
+    CheckKey = Tuple[str, str, str, str, int]
+    groups: Dict[CheckKey, List[Dict[str, Any]]] = {}
+    for it in items:
+        key = (it['origen'], it['destino'], it['fecha'], it['salida'], it['tolerancia_min'])
+        groups.setdefault(key, []).append(it)
+
+    # ---- Scraping async: un navegador, un contexto por carril (acotados) ----
+    async def _lane(browser, keys: List[CheckKey]) -> Dict[CheckKey, Optional[Dict[str, Any]]]:
+        out: Dict[CheckKey, Optional[Dict[str, Any]]] = {}
         try:
-            res = await asyncio.to_thread(_task)
-            return it, res
+            async with RenfeScraperPlaywrightAsync(browser=browser) as s:
+                for key in keys:
+                    origen, destino, fecha, salida, tolerancia = key
+                    try:
+                        # Permiso por búsqueda, no por carril: así un /m interactivo
+                        # entra entre dos búsquedas en vez de esperar al ciclo entero
+                        async with SCRAPE_SEM:
+                            out[key] = await s.esta_lleno_en_hora(
+                                origen=origen,
+                                destino=destino,
+                                fecha=fecha,            # dd/mm/YYYY
+                                hora_objetivo=salida,   # HH:MM
+                                tolerancia_min=tolerancia,
+                                imprimir=False,
+                            )
+                    except Exception as e:
+                        print(f"⚠️ Error comprobando {origen}->{destino} {fecha} {salida}: {e}")
+                        out[key] = None
         except Exception as e:
-            print(f"⚠️ Error comprobando {it.origen}->{it.destino} {it.fecha} {it.salida}: {e}")
-            return it, None
+            print(f"⚠️ No se pudo abrir un contexto de navegador: {e}")
+        return out
+
+    # Misma búsqueda (origen, destino, fecha) en el mismo carril para que el
+    # scraper reutilice los resultados entre horas distintas
+    por_busqueda: Dict[Tuple[str, str, str], List[CheckKey]] = {}
+    for key in groups:
+        por_busqueda.setdefault(key[:3], []).append(key)
+    lanes: List[List[CheckKey]] = [[] for _ in range(min(SCRAPE_CONCURRENCY, len(por_busqueda)))]
+    for i, keys in enumerate(por_busqueda.values()):
+        lanes[i % len(lanes)].extend(keys)
+
+    results_by_key: Dict[CheckKey, Optional[Dict[str, Any]]] = {}
+    try:
+        async with lanzar_navegador(headless=True) as browser:
+            for parcial in await asyncio.gather(*[_lane(browser, lane) for lane in lanes]):
+                results_by_key.update(parcial)
+    except Exception as e:
+        print(f"⚠️ No se pudo lanzar el navegador para la comprobación: {e}")
 
-    results: List[Tuple[MonitoredTrain, Optional[Dict[str, Any]]]] = await asyncio.gather(
-        *[_check_item(it) for it in items],
-        return_exceptions=False
-    )
+    # Reparto del resultado a cada chat suscrito
+    results: List[Tuple[Dict[str, Any], Optional[Dict[str, Any]]]] = [
+        (it, results_by_key.get(key)) for key, members in groups.items() for it in members
+    ]
 
-    # ---- Notificaciones por 'OK' y borrado de ids ----
-    to_remove_ids: List[str] = []
+    # ---- Notificaciones por 'OK' (un mensaje por chat) y borrado de ids ----
+    ok_by_chat: Dict[int, List[str]] = {}
+    ids_by_chat: Dict[int, List[str]] = {}
     for it, res in results:
         if not res:
             continue
         estado = (res.get("estado") or "").upper()
         if estado == "OK":
-            try:
-                await context.bot.send_message(
-                    chat_id=it.chat_id,
-                    text=(
-                        f"🎉 Buenas noticias: el viaje que estaba lleno ahora tiene plazas libres.\n\n"
-                        f"• *{it.origen} → {it.destino}*\n"
-                        f"• *{it.fecha}* — salida *{res.get('salida') or it.salida}* "
-                        f"(llegada {res.get('llegada','?')})\n\n"
-                        f"¡Corre a por él! 🚄"
-                    ),
-                    parse_mode=ParseMode.MARKDOWN,
-                )
-                to_remove_ids.append(it.id)  # evita repetir aviso
-            except Exception as e:
-                print(f"⚠️ No pude enviar el aviso de hueco al chat {it.chat_id}: {e}")
+            ok_by_chat.setdefault(it['chat_id'], []).append(
+                f"• *{it['origen']} → {it['destino']}*\n"
+                f"• *{it['fecha']}* — salida *{res.get('salida') or it['salida']}* "
+                f"(llegada {res.get('llegada','?')})"
+            )
+            ids_by_chat.setdefault(it['chat_id'], []).append(it['id'])
+
+    to_remove_ids: List[str] = []
+    for chat_id, bloques in ok_by_chat.items():
+        if len(bloques) == 1:
+            cabecera = "🎉 Buenas noticias: el viaje que estaba lleno ahora tiene plazas libres."
+            cierre = "¡Corre a por él! 🚄"
+        else:
+            cabecera = "🎉 Buenas noticias: estos viajes que estaban llenos ahora tienen plazas libres."
+            cierre = "¡Corre a por ellos! 🚄"
+        try:
+            await bot.send_message(
+                chat_id=chat_id,
+                text="\n\n".join([cabecera, *bloques, cierre]),
+                parse_mode=MD,
+            )
+            to_remove_ids.extend(ids_by_chat[chat_id])  # evita repetir aviso
+        except Exception as e:
+            print(f"⚠️ No pude enviar el aviso de hueco al chat {chat_id}: {e}")
 
     if to_remove_ids:
         try:
-            STORE.remove_ids(to_remove_ids)
+            await STORE.remove_ids(to_remove_ids)
         except Exception as e:
             print(f"⚠️ No pude eliminar ids {to_remove_ids} del JSON: {e}")
 
     # ---- Resumen final del ciclo: consola + (opcional) chat ----
     print("🧾 Resumen monitorización:")
-    resumen_por_chat: Dict[int, List[str]] = {}
+    resumen_por_chat: Dict[int, List[str]] = (
+        {chat: [] for chat in chats} if MONITOR_CHAT_NOTIFICATIONS else {}
+    )
 
     for it, res in results:
         estado = (res or {}).get("estado", "?")
         estado_up = (estado or "").upper()
         icon = "✓" if estado_up == "OK" else ("✗" if estado_up == "LLENO" else "?")
-        linea = f"{icon} {it.origen} → {it.destino} | {it.fecha} {it.salida} — {estado}"
+        linea = f"{icon} {it['origen']} → {it['destino']} | {it['fecha']} {it['salida']} — {estado}"
         print("   " + linea)
 
         if MONITOR_CHAT_NOTIFICATIONS:
-            resumen_por_chat.setdefault(it.chat_id, []).append("• " + linea)
+            resumen_por_chat[it['chat_id']].append("• " + linea)
 
     if MONITOR_CHAT_NOTIFICATIONS:
         for chat_id, lineas in resumen_por_chat.items():
+            if not lineas:
+                continue
             try:
-                await context.bot.send_message(
+                await bot.send_message(
                     chat_id=chat_id,
                     text="📊 Resultados de la comprobación:\n" + "\n".join(lineas)
                 )
@@ -256,90 +381,97 @@ async def _check_once_and_notify(context: CallbackContext) -> None:
                 print(f"⚠️ No pude enviar resumen al chat {chat_id}: {e}")
 
 
-async def _periodic_scheduler(context: CallbackContext) -> None:
-    """
-    Job auto-reprogramable:
-    - Ejecuta una pasada de comprobación
-    - Agenda la siguiente en 5–15 minutos (aleatorio)
-    """
-    # 1) Pasada de comprobación
-    await _check_once_and_notify(context)
-
-    # 2) Reprogramación con intervalo aleatorio
-    next_seconds = random.randint(3 * 60, 5*60)
-    context.job_queue.run_once(
-        _periodic_scheduler,
-        when=timedelta(seconds=next_seconds),
-        name="renfe_periodic_check",
-    )
+PERIODIC_TASK_KEY = "renfe_periodic_task"
 
-def schedule_first_check(app: Application) -> None:
+async def _periodic_loop(app: Application) -> None:
     """
-    Llama a esto tras construir el Application para disparar el primer check
-    en 5–15 minutos. Luego se auto-reagenda.
+    Bucle de comprobación de larga duración (una sola tarea):
+    - Espera inicial aleatoria de 3–5 minutos (varias instancias no se sincronizan)
+    - Ejecuta una pasada de comprobación
+    - Duerme 3–5 minutos (aleatorio) y repite
     """
-    first_in = random.randint(3*60, 5*60)
-    app.job_queue.run_once(
-        _periodic_scheduler,
-        when=timedelta(seconds=first_in),
-        name="renfe_periodic_check",
-    )
+    await asyncio.sleep(random.randint(3 * 60, 5 * 60))
+    while True:
+        # 1) Pasada de comprobación; un fallo no debe matar el bucle
+        try:
+            await _check_once_and_notify(app.bot)
+        except Exception as e:
+            print(f"⚠️ Error en la comprobación periódica: {e}")
+
+        # 2) Espera con intervalo aleatorio
+        await asyncio.sleep(random.randint(3 * 60, 5 * 60))
+
+async def _start_periodic_loop(app: Application) -> None:
+    """post_init: arranca el bucle periódico (sin depender del job_queue)."""
+    # Tarea de asyncio, no app.create_task: Application.stop() esperaría
+    # a que terminase y el bucle no termina nunca. Se cancela en post_stop.
+    app.bot_data[PERIODIC_TASK_KEY] = asyncio.create_task(_periodic_loop(app))
+
+async def _stop_periodic_loop(app: Application) -> None:
+    """post_stop: cancela el bucle periódico si está en marcha."""
+    task = app.bot_data.pop(PERIODIC_TASK_KEY, None)
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
 
 #########################33
 
 
 # ============================== Utilidades bot ============================== #
-def greet_text() -> str:
-    return (
-        "Bienvenido a *Renfe Bot* 👋\n\n"
-        "Este bot en monitoriza viajes llenos y te envía un mensaje en cuanto haya hueco.\n"
-        "Comandos:\n"
-        "• `/m` — iniciar flujo para listar y guardar\n"
-        "• `/list` — ver tus viajes guardados\n"
-        "• `/delete` — eliminar un viaje guardado por índice\n"
-        "• `/h` — ayuda\n"
-        "• Escribe `stop` para cancelar en cualquier momento\n"
-    )
-def help_text() -> str:
-    return (
-        "*Ayuda — Renfe Bot*\n\n"
-        "Comandos principales:\n"
-        "• `/m`  Añadir un viaje para monitorizar\n"
-        "• `/list`  Ver viajes guardados\n"
-        "• `/delete`  Borrar un viaje\n"
-        "• `/stop`  Cancelar la conversación actual\n\n"
-        "Flujo básico:\n"
-        "1. Usa `/m` y dime origen, destino y fecha (dd/mm/YYYY).\n"
-        "\t1.1 Importante añadir el nombre como aparece en la web de Renfe\n"
-        "2. Te mostraré los trenes de ese día.\n"
-        "3. Elige el número del trayecto para guardarlo.\n\n"
-        "El bot comprobará periódicamente si hay plazas libres "
-        "y te avisará automáticamente. 🚄"
-    )
+GREET_TEXT = (
+    "Bienvenido a *Renfe Bot* 👋\n\n"
+    "Este bot en monitoriza viajes llenos y te envía un mensaje en cuanto haya hueco.\n"
+    "Comandos:\n"
+    "• `/m` — iniciar flujo para listar y guardar\n"
+    "• `/list` — ver tus viajes guardados\n"
+    "• `/delete` — eliminar un viaje guardado por índice\n"
+    "• `/h` — ayuda\n"
+    "• Escribe `stop` para cancelar en cualquier momento\n"
+)
+HELP_TEXT = (
+    "*Ayuda — Renfe Bot*\n\n"
+    "Comandos principales:\n"
+    "• `/m`  Añadir un viaje para monitorizar\n"
+    "• `/list`  Ver viajes guardados\n"
+    "• `/delete`  Borrar un viaje\n"
+    "• `/stop`  Cancelar la conversación actual\n\n"
+    "Flujo básico:\n"
+    "1. Usa `/m` y dime origen, destino y fecha (dd/mm/YYYY).\n"
+    "\t1.1 Importante añadir el nombre como aparece en la web de Renfe\n"
+    "2. Te mostraré los trenes de ese día.\n"
+    "3. Elige el número del trayecto para guardarlo.\n\n"
+    "El bot comprobará periódicamente si hay plazas libres "
+    "y te avisará automáticamente. 🚄"
+)
 
 def now_madrid() -> datetime:
     return datetime.now(TZ_MADRID)
 
 def normalize_date(s: str) -> Optional[str]:
     s = s.strip()
-    if not DATE_RE.match(s):
+    # strptime valida el formato; la longitud exige día y mes con dos dígitos
+    if len(s) != 10:
         return None
     try:
         datetime.strptime(s, "%d/%m/%Y")
         return s
-    except Exception:
+    except ValueError:
         return None
 
 def parse_sort_key(item: MonitoredTrain) -> Tuple[int, int]:
     """Devuelve (yyyymmdd, hhmm) para ordenar por fecha y salida."""
+    # fecha ya viene validada como dd/mm/YYYY: basta con cortar por posición
+    f = item.fecha
     try:
-        d = datetime.strptime(item.fecha, "%d/%m/%Y")
-        ymd = d.year * 10000 + d.month * 100 + d.day
+        ymd = int(f[6:]) * 10000 + int(f[3:5]) * 100 + int(f[:2])
     except Exception:
         ymd = 0
+    h = item.salida
     try:
-        hh, mm = item.salida.split(":")
-        hm = int(hh) * 100 + int(mm)
+        hm = int(h[:2]) * 100 + int(h[3:5])
     except Exception:
         hm = -1
     return (ymd, hm)
@@ -352,7 +484,7 @@ def format_saved_list(items: List[MonitoredTrain]) -> Tuple[str, List[str]]:
         return "No tienes viajes guardados.", []
 
     # Orden por fecha y hora de salida
-    items_sorted = sorted(items, key=parse_sort_key)
+    items_sorted = sorted(items, key=lambda it: it.sort_key)
     lines = []
     ids = []
     for i, it in enumerate(items_sorted, start=1):
@@ -369,30 +501,25 @@ def fmt_train_line(n: int, origen: str, destino: str, v: Dict[str, Any]) -> str:
 
 async def run_scraper_search(origen: str, destino: str, fecha: str) -> List[Dict[str, str]]:
     """
-    Usa TU scraper Playwright:
-    - buscar_billetes(...) para preparar la página.
-    - _extraer_trayectos_ida() para obtener la lista de viajes.
+    Usa TU scraper Playwright (versión async, en el propio event loop):
+    buscar_billetes(...) ya devuelve la lista de viajes extraída en 'viajes'.
     """
-    def _task():
-        with RenfeScraperPlaywright(headless=True) as s:
-            s.buscar_billetes(origen=origen, destino=destino, fecha=fecha)
-            viajes = s._extraer_trayectos_ida()
-            return viajes
-
-    return await asyncio.to_thread(_task)
+    async with SCRAPE_SEM:
+        async with RenfeScraperPlaywrightAsync(headless=True) as s:
+            return (await s.buscar_billetes(origen=origen, destino=destino, fecha=fecha))["viajes"]
 
 
 # ============================== Handlers principales ======================== #
 async def cmd_start(update: Update, context: CallbackContext) -> None:
-    await update.effective_message.reply_text(greet_text(), parse_mode=ParseMode.MARKDOWN)
+    await update.effective_message.reply_text(GREET_TEXT, parse_mode=MD)
 
 async def cmd_help(update: Update, context: CallbackContext) -> None:
-    await update.effective_message.reply_text(help_text(), parse_mode=ParseMode.MARKDOWN)
+    await update.effective_message.reply_text(HELP_TEXT, parse_mode=MD)
 
 async def cancel_any(update: Update, context: CallbackContext) -> int:
     """Cancela en cualquier momento con 'stop' o '/stop'."""
     context.user_data.clear()
-    await update.effective_message.reply_text(greet_text(), parse_mode=ParseMode.MARKDOWN)
+    await update.effective_message.reply_text(GREET_TEXT, parse_mode=MD)
     return ConversationHandler.END
 
 
@@ -437,7 +564,7 @@ async def show_trains(update: Update, context: CallbackContext) -> int:
 
     lines = [fmt_train_line(i + 1, origen, destino, v) for i, v in enumerate(viajes)]
     lines.append("\nResponde con el *número* del tren a guardar en JSON.\n(Escribe `stop` para cancelar.)")
-    await msg.edit_text("\n".join(lines), parse_mode=ParseMode.MARKDOWN)
+    await msg.edit_text("\n".join(lines), parse_mode=MD)
     return CHOOSE_TRAIN
 
 async def choose_train(update: Update, context: CallbackContext) -> int:
@@ -446,7 +573,7 @@ async def choose_train(update: Update, context: CallbackContext) -> int:
     try:
         idx = int(text) - 1
     except Exception:
-        await update.message.reply_text("Por favor, envía un número válido (o `stop` para cancelar).", parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_text("Por favor, envía un número válido (o `stop` para cancelar).", parse_mode=MD)
         return CHOOSE_TRAIN
 
     viajes = context.user_data.get("viajes", [])
@@ -454,7 +581,7 @@ async def choose_train(update: Update, context: CallbackContext) -> int:
         await update.message.reply_text("No tengo la lista de trenes en memoria. Vuelve a usar /m.")
         return ConversationHandler.END
     if not (0 <= idx < len(viajes)):
-        await update.message.reply_text("Índice fuera de rango (o escribe `stop` para cancelar).", parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_text("Índice fuera de rango (o escribe `stop` para cancelar).", parse_mode=MD)
         return CHOOSE_TRAIN
 
     elegido = viajes[idx]
@@ -469,7 +596,7 @@ async def choose_train(update: Update, context: CallbackContext) -> int:
             f"ℹ️ Para *{fecha}* el tren **{origen} → {destino}** "
             f"({elegido['salida']}–{elegido['llegada']}) *no está lleno*.\n"
             "✅ Puedes comprarlo ya.\n\n",
-            parse_mode=ParseMode.MARKDOWN,
+            parse_mode=MD,
         )
         # Limpieza del estado conversacional
         for k in ("viajes", "origen", "destino", "fecha"):
@@ -486,12 +613,12 @@ async def choose_train(update: Update, context: CallbackContext) -> int:
         salida=elegido["salida"],
         tolerancia_min=5,
     )
-    STORE.add(item)
+    await STORE.add(item)
 
     await update.message.reply_text(
         "✅ Añadido a *lista de monitorización*:\n"
         f"{origen} → {destino} | {fecha} {item.salida}\n",
-        parse_mode=ParseMode.MARKDOWN,
+        parse_mode=MD,
     )
 
     for k in ("viajes", "origen", "destino", "fecha"):
@@ -521,7 +648,7 @@ async def cmd_delete(update: Update, context: CallbackContext) -> int:
     context.user_data["del_ids"] = ids
     await update.effective_message.reply_text(
         f"{text}\n\nEscribe el *número* del viaje que quieres eliminar (o `stop` para cancelar).",
-        parse_mode=ParseMode.MARKDOWN,
+        parse_mode=MD,
     )
     return DEL_CHOOSE
 
@@ -530,7 +657,7 @@ async def choose_delete(update: Update, context: CallbackContext) -> int:
     try:
         idx = int(text) - 1
     except Exception:
-        await update.message.reply_text("Por favor, envía un número válido (o `stop` para cancelar).", parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_text("Por favor, envía un número válido (o `stop` para cancelar).", parse_mode=MD)
         return DEL_CHOOSE
 
     ids = context.user_data.get("del_ids", [])
@@ -539,10 +666,10 @@ async def choose_delete(update: Update, context: CallbackContext) -> int:
         return ConversationHandler.END
 
     if not (0 <= idx < len(ids)):
-        await update.message.reply_text("Índice fuera de rango (o escribe `stop` para cancelar).", parse_mode=ParseMode.MARKDOWN)
+        await update.message.reply_text("Índice fuera de rango (o escribe `stop` para cancelar).", parse_mode=MD)
         return DEL_CHOOSE
 
-    removed = STORE.remove_ids([ids[idx]])
+    removed = await STORE.remove_ids([ids[idx]])
     if removed:
         await update.message.reply_text("🗑️ Viaje eliminado.")
     else:
@@ -562,6 +689,8 @@ def build_application() -> Application:
         ApplicationBuilder()
         .token(token)
         .rate_limiter(AIORateLimiter())
+        .post_init(_start_periodic_loop)
+        .post_stop(_stop_periodic_loop)
         .build()
     )
 
@@ -631,8 +760,20 @@ def build_application() -> Application:
 def main() -> None:
     app = build_application()
     print("Bot arrancando…")
-    schedule_first_check(app)
-    app.run_polling(close_loop=False)
+
+    # Webhook si está configurado (producción); si no, long polling (desarrollo)
+    webhook_url = os.environ.get("TG_WEBHOOK_URL")
+    if webhook_url:
+        app.run_webhook(
+            listen="0.0.0.0",
+            port=int(os.environ.get("PORT", "8443")),
+            url_path=os.environ.get("TG_WEBHOOK_PATH", ""),
+            webhook_url=webhook_url,
+            secret_token=os.environ.get("TG_WEBHOOK_SECRET"),
+            close_loop=False,
+        )
+    else:
+        app.run_polling(close_loop=False)
 
 
 if __name__ == "__main__":